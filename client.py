@@ -12,28 +12,189 @@ Date: April 2025
 Version: 1.0
 """
 
+import asyncio
+import os
 import socket
-import threading
+import sys
 
 # Global constants
 PORT = 55555
 SERVER = '127.0.0.1'
+HEADER_SIZE = 4  # Every frame starts with its payload length as a big-endian integer
+BUFSIZE = 65536  # Bytes requested per recv, large enough for a full history dump
+SOCKET_BUFSIZE = 4 * 1024 * 1024  # Kernel send/receive buffers, absorb history dumps and pastes
+
+# Control messages sent to the server, encoded once at import time
+MSG_DISCONNECT = b"[DISCONNECTED]"
+MSG_HELP = b"[HELP]"
+MSG_HISTORY = b"[HISTORY]"
+
+# Session states tracked by receive_messages
+STATE_CLOSED = -1  # The server ended the session
+STATE_IDLE = 0     # Waiting for a partner
+STATE_CHAT = 1     # Paired, partner messages are displayed
+
+_stdin_pending = bytearray()  # Typed bytes not yet terminated by a newline
+
+def _next_line():
+    """Pops the next complete line (without its line ending) from `_stdin_pending`, or returns None."""
+    end = _stdin_pending.find(b'\n')
+    if end < 0:
+        return None
+    line = bytes(_stdin_pending[:end]).rstrip(b'\r')
+    del _stdin_pending[:end + 1]
+    return line
+
+def _read_line_blocking():
+    """
+    Reads one line from stdin, blocking until it is complete.
+
+    Reads the raw file descriptor into `_stdin_pending`, like `_read_stdin`
+    does, so the username and every later line come from the same buffer and
+    nothing is left behind in `sys.stdin`'s own buffer when input is piped.
+
+    Returns:
+        bytes | None: The line as raw bytes, or None at end of input.
+    """
+    line = _next_line()
+    while line is None:
+        data = os.read(sys.stdin.fileno(), BUFSIZE)
+        if not data:
+            if not _stdin_pending:
+                return None
+            line = bytes(_stdin_pending)
+            _stdin_pending.clear()
+            return line
+        _stdin_pending.extend(data)
+        line = _next_line()
+    return line
 
 # Initialize the client socket
-username = input("Enter your username: ")
+print("Enter your username: ", end="", flush=True)
+username = (_read_line_blocking() or b"").decode('utf-8', 'replace')
+USERNAME_HELLO = f"[USERNAME]{username}".encode('utf-8')
+USER_PREFIX = f"{username}: ".encode('utf-8')  # Prepended to every chat line
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# Sized before connect so the receive window scale is negotiated in the handshake
+for opt in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+    client_socket.setsockopt(socket.SOL_SOCKET, opt, SOCKET_BUFSIZE)
 client_socket.connect((SERVER, PORT))
+# Chat lines are small, send them right away instead of waiting for Nagle coalescing
+client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+# The event loop drives the socket, so it must never block the reactor
+client_socket.setblocking(False)
+# Preallocated receive buffer, reused by every recv to avoid per-message allocations
+_rxbuf = bytearray(BUFSIZE)
+_rxview = memoryview(_rxbuf)
+_HAS_SENDMSG = hasattr(client_socket, 'sendmsg')  # Not available on Windows
+
+async def send_frame(sock, tag, payload=b""):
+    """
+    Sends a tagged message to the server as a single length-prefixed frame.
+
+    The header, tag and payload are written with one `sendmsg` gather call;
+    only a partial write falls back to the event loop's `sock_sendall`.
+
+    Args:
+        sock (socket.socket): The connected client socket.
+        tag (bytes): The protocol tag, e.g. MSG_HELP, or USER_PREFIX for chat text.
+        payload (bytes): Optional data following the tag.
+
+    Returns:
+        None
+    """
+    parts = ((len(tag) + len(payload)).to_bytes(HEADER_SIZE, 'big'), tag, payload)
+    sent = 0
+    if _HAS_SENDMSG:
+        # Hand the pieces to the kernel as one gather write, no concatenation
+        try:
+            sent = sock.sendmsg(parts)
+        except (BlockingIOError, InterruptedError):
+            pass
+        if sent == HEADER_SIZE + len(tag) + len(payload):
+            return
+    # Send buffer full (or no sendmsg): let the event loop finish the frame
+    await asyncio.get_running_loop().sock_sendall(sock, b"".join(parts)[sent:])
+
+async def read_frames(sock):
+    """
+    Yields the payload of every complete length-prefixed frame from the server.
+
+    Each recv fills the shared receive buffer and every complete frame in
+    it is yielded before the next recv. Only an incomplete trailing frame
+    is copied into a rolling accumulator, so frames split across or packed
+    into TCP segments are both handled without copying whole reads.
+
+    Args:
+        sock (socket.socket): The connected client socket.
+
+    The generator simply returns once the server closes the connection
+    (a zero-length recv), so a normal disconnect raises no exception.
+
+    Yields:
+        bytes: The frame payload.
+    """
+    loop = asyncio.get_running_loop()
+    pending = bytearray()
+    while True:
+        n = await loop.sock_recv_into(sock, _rxview)
+        if n == 0:
+            return
+        if pending:
+            pending += _rxview[:n]
+            data = pending
+        else:
+            # Nothing carried over: parse straight out of the receive buffer
+            data = _rxview[:n]
+        size = len(data)
+        pos = 0
+        while size - pos >= HEADER_SIZE:
+            end = pos + HEADER_SIZE + int.from_bytes(data[pos:pos + HEADER_SIZE], 'big')
+            if size < end:
+                break
+            yield bytes(data[pos + HEADER_SIZE:end])
+            pos = end
+        if data is pending:
+            del pending[:pos]
+        else:
+            pending += data[pos:]
+
+def _on_chat_found():
+    """Handles "[CHAT_FOUND]": a partner has been found."""
+    print("You're allowed to type message now!")
+    return STATE_CHAT
+
+def _on_partner_left():
+    """Handles "[PARTNER_LEFT]": the chat partner has disconnected."""
+    print("Your chat partner has left the chat. Trying to find a new partner...")
+    return STATE_IDLE
 
-def receive_messages():
+def _on_disconnected():
+    """Handles "[DISCONNECTED]": the server ended the session."""
+    print("Disconnected from the server.")
+    return STATE_CLOSED
+
+# Control tag -> handler; each handler returns the new session state
+_HANDLERS = {
+    b"[CHAT_FOUND]": _on_chat_found,
+    b"[PARTNER_LEFT]": _on_partner_left,
+    b"[DISCONNECTED]": _on_disconnected,
+}
+_MAX_TAG_LEN = max(map(len, _HANDLERS))  # Longer frames cannot be control tags
+
+async def receive_messages():
     """
     Receive and handle incoming messages from the server.
 
-    This function runs in a separate thread, constantly listening for messages
-    from the server and printing them to the user's console.
+    This coroutine runs on the client's event loop, constantly awaiting
+    data on the socket and printing messages to the user's console.
+    Control tags are matched on the raw frame bytes and dispatched through
+    `_HANDLERS`; only chat text is decoded.
 
     Message types handled:
     - "[CHAT_FOUND]": Notifies that a partner has been found.
     - "[PARTNER_LEFT]": Informs that the chat partner has disconnected.
+    - "[DISCONNECTED]": The server closed the session.
     - Regular text messages from the partner.
 
     Args:
@@ -41,83 +202,173 @@ def receive_messages():
     Returns:
         None
     """
-    partner_found = False
-    while True:
-        try:
-            message = client_socket.recv(1024).decode('utf-8')
-            if message == "[CHAT_FOUND]":
-                print("You're allowed to type message now!")
-                partner_found = True
-            elif message == "[PARTNER_LEFT]":
-                print("Your chat partner has left the chat. Trying to find a new partner...")
-                partner_found = False
-            elif partner_found:
-                print(f"{message}")
-                partner_found = True
-            elif message == "[DISCONNECTED]":
-                print("Disconnected from the server.")
-                partner_found = False
-                client_socket.close()
-                break
+    # Globals used once per frame are bound to locals (LOAD_FAST instead of dict lookups)
+    get_handler = _HANDLERS.get
+    max_tag_len = _MAX_TAG_LEN
+    state_chat = STATE_CHAT
+    _print = print
+    state = STATE_IDLE
+    try:
+        async for raw in read_frames(client_socket):
+            handler = get_handler(raw) if len(raw) <= max_tag_len else None
+            if handler:
+                state = handler()
+                if state == STATE_CLOSED:
+                    break
+            elif state == state_chat:
+                _print(str(raw, 'utf-8', 'replace'))
             else:
-                print(f"Unknown message: {message}")
-                partner_found = False
-        except Exception as e:
-            partner_found = False
-            print(f"Error receiving message: {e}")
-            client_socket.close()
-            break
-        except KeyboardInterrupt:
-            partner_found = False
-            print("\nExiting chat...")
-            client_socket.close()
-            break
-
-def send_messages():
-    """
-    Sends a message to the server, encoding it in UTF-8.
+                _print(f"Unknown message: {str(raw, 'utf-8', 'replace')}")
+                state = STATE_IDLE
+        else:
+            # The stream ended: the server closed the connection
+            _print("Disconnected from the server.")
+    except OSError as e:
+        print(f"Error receiving message: {e}")
+
+def _read_stdin(lines):
+    """
+    Reader callback run by the event loop whenever stdin is readable.
+
+    Reads whatever the terminal delivered, queues every complete line as
+    raw bytes and keeps the remainder for the next call. None is queued at
+    end of input.
 
     Args:
-        message (str): The message to send.
+        lines (asyncio.Queue): Queue consumed by `send_messages`.
+
+    Returns:
+        None
+    """
+    data = os.read(sys.stdin.fileno(), BUFSIZE)
+    if not data:
+        asyncio.get_running_loop().remove_reader(sys.stdin)
+        if _stdin_pending:
+            lines.put_nowait(bytes(_stdin_pending))
+        lines.put_nowait(None)
+        return
+    _stdin_pending.extend(data)
+    _queue_lines(lines)
+
+def _queue_lines(lines):
+    """Moves every complete line of `_stdin_pending` to the `lines` queue."""
+    line = _next_line()
+    while line is not None:
+        lines.put_nowait(line)
+        line = _next_line()
+
+async def _cmd_exit():
+    """Handles /exit: tells the server we are leaving and ends the input loop."""
+    print("Exiting chat...")
+    await send_frame(client_socket, MSG_DISCONNECT)
+    return False
+
+async def _cmd_help():
+    """Handles /help: lists the available commands."""
+    await send_frame(client_socket, MSG_HELP)
+    print("Available commands: /exit - Leave chat, /help - Show this message")
+    return True
+
+async def _cmd_history():
+    """Handles /history: asks the server for the user's previous sessions."""
+    await send_frame(client_socket, MSG_HISTORY)
+    print("Fetching chat history in the previous sessions.")
+    return True
+
+# Slash command -> handler; each handler returns False once input should stop
+_CMDS = {
+    b'/exit': _cmd_exit,
+    b'/help': _cmd_help,
+    b'/history': _cmd_history,
+}
+
+async def send_messages():
+    """
+    Reads user input and sends it to the server.
+
+    Lines stay as the raw UTF-8 bytes read from stdin, so chat text goes
+    out without a decode/encode round-trip; it is only decoded for the
+    local echo.
+
+    Stdin is registered with the event loop's selector next to the socket,
+    so a single thread waits on both. When stdin cannot be watched (the
+    Windows proactor, or a regular file that epoll refuses), lines are read
+    with `_read_line_blocking` in the loop's executor instead.
+    Lines already buffered while reading the username are sent first.
 
     Returns:
         None
     """
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    try:
+        loop.add_reader(sys.stdin, _read_stdin, lines)
+    except (NotImplementedError, OSError):
+        lines = None
+    else:
+        _queue_lines(lines)
     # Sending first message to the server with the username
-    client_socket.send(f"[USERNAME]{username}".encode('utf-8'))
+    await send_frame(client_socket, USERNAME_HELLO)
+    sock = client_socket
+    _send_frame = send_frame
+    get_command = _CMDS.get
+    prefix = USER_PREFIX
+    echo_prefix = f"{username}: "
+    _print = print
     # Loop to send messages until the user exits
-    while True:
-        try:
-            message = input()
-            if message.lower() == '/exit':
-                print("Exiting chat...")
-                client_socket.send("[DISCONNECTED]".encode('utf-8'))
-                client_socket.close()
+    try:
+        while True:
+            try:
+                if lines is not None:
+                    message = await lines.get()
+                else:
+                    message = await loop.run_in_executor(None, _read_line_blocking)
+                if message is None:
+                    break
+                # Plain chat lines (the common case) only pay for this one-byte check
+                command = get_command(message.split(None, 1)[0].lower()) if message[:1] == b'/' else None
+                if command:
+                    if not await command():
+                        break
+                else:
+                    await _send_frame(sock, prefix, message)
+                    _print(echo_prefix + message.decode('utf-8', 'replace'))
+            except Exception as e:
+                print(f"Error sending message: {e}")
                 break
-            elif message.lower() == '/help':
-                client_socket.send("[HELP]".encode('utf-8'))
-                print("Available commands: /exit - Leave chat, /help - Show this message")
-            elif message.startswith('/history'):
-                client_socket.send("[HISTORY]".encode('utf-8'))
-                print("Fetching chat history in the previous sessions.")
-            else:
-                client_socket.send(f"{username}: {message}".encode('utf-8'))
-                print(f"{username}: {message}")
-        except Exception as e:
-            print(f"Error sending message: {e}")
-            client_socket.close()
-            break
-        except KeyboardInterrupt:
-            print("\nExiting chat...")
-            client_socket.close()
-            break
+    finally:
+        if lines is not None:
+            loop.remove_reader(sys.stdin)
+
+async def main():
+    """
+    Runs the receive and send coroutines side by side on one event loop.
+
+    Whichever side finishes first (server disconnect or `/exit`) ends the
+    session; the other one is cancelled so the socket can be closed safely.
+    An exception raised by either side is printed rather than dropped.
+
+    Returns:
+        None
+    """
+    tasks = [asyncio.ensure_future(receive_messages()), asyncio.ensure_future(send_messages())]
+    _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    # Only the CancelledError we caused is expected; report any other failure
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error in chat session: {task.exception()!r}")
+
 def start_client():
     """
     Initialize and run the client-side application.
 
-    This function establishes a connection to the central server,
-    starts a background thread for receiving messages, and handles
-    user input in the main thread. Users can send messages or exit the chat
+    This function establishes a connection to the central server and
+    runs a single-threaded event loop that both receives messages and
+    handles user input. Users can send messages or exit the chat
     using commands.
 
     Commands:
@@ -132,15 +383,11 @@ def start_client():
     print("Type '/exit' to leave the chat.")
     print("Type '/history' to fetch chat history.")
     print("Type '/help' for available commands.")
-    # Start the threads for receiving and sending messages
-    receive_thread = threading.Thread(target=receive_messages)
-    receive_thread.start()
-    send_thread = threading.Thread(target=send_messages)
-    send_thread.start()
-    # Wait for threads to finish
-    receive_thread.join()
-    send_thread.join()
-    # Close the client socket
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nExiting chat...")
+    # Close the client socket (the only place it is closed)
     client_socket.close()
     print("Client socket closed. Exiting program.")
 if __name__ == "__main__":
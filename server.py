@@ -5,339 +5,641 @@ This script represents the server-side application, allowing multiple clients to
 - Pair clients randomly for chat sessions.
 - Handle real-time messaging between paired clients.
 - Notify clients when their partner has disconnected.
-- Store conversation history in a JSON file.
+- Store conversation history in a JSON Lines file.
 Author: Le Huyen-Trang
 Date: April 2025
 Version: 1.0
 """
-import socket
-import threading
-import time
+import asyncio
 import datetime
+import socket
 from queue import Queue
 import json
-from threading import Lock
 import os
+import threading
+
+try:
+    import orjson  # Optional, serialises chat logs several times faster than json
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl  # POSIX only; serialises log rotation between worker processes
+except ImportError:
+    fcntl = None
+
+try:
+    import uvloop  # Optional, libuv-based event loop that is faster than asyncio's default
+except ImportError:
+    uvloop = None
 
 # Global constants
 PORT = 55555
 SERVER = '127.0.0.1'
-
-# Global state
-waiting_clients = []  # Clients waiting to be paired
+HEADER_SIZE = 4  # Every frame starts with its payload length as a big-endian integer
+WRITE_BUFFER_HIGH = 16 * 1024  # Bytes queued per client before a relay waits for the socket
+READ_SIZE = 65536  # Bytes requested from a client's stream per read
+MAX_FRAME_SIZE = int(os.environ.get("CHAT_MAX_FRAME", 1024 * 1024))  # Largest frame payload a client may send
+# Errors meaning the connection itself is gone (OSError covers ConnectionError); anything else is a bug and is not swallowed
+CONNECTION_ERRORS = (OSError, asyncio.IncompleteReadError)
+LOG_FILE_PATH = "history/chat_logs.jsonl"  # One chat log (JSON object) per line
+LOG_MAX_SIZE = 64 * 1024 * 1024             # Bytes after which the log file is rotated
+LOG_LOCK_PATH = LOG_FILE_PATH + ".lock"     # Locked by the worker rotating the log files
+LOG_BACKUP_COUNT = 5  # Rotated files kept (chat_logs.jsonl.1 newest .. .5 oldest); older ones are deleted
+
+# Control messages, encoded once
+MSG_CONNECTED = b"[CONNECTED]"
+MSG_INVALID_USERNAME = b"[INVALID_USERNAME]"
+MSG_NO_PARTNER_FOUND = b"[NO_PARTNER_FOUND]"
+MSG_CHAT_FOUND = b"[CHAT_FOUND]"
+MSG_PARTNER_LEFT = b"[PARTNER_LEFT]"
+MSG_PARTNER_DISCONNECTED = b"[PARTNER_DISCONNECTED]"
+MSG_HELP = b"[HELP]"
+MSG_HISTORY = b"[HISTORY]"
+MSG_DISCONNECTED = b"[DISCONNECTED]"
+MSG_NO_HISTORY = b"No chat history available for this user."
+USERNAME_PREFIX = b"[USERNAME]"
+MAX_USERNAME_FRAME = 256  # Largest username frame accepted, prefix included
+SNDBUF_SIZE = int(os.environ.get("CHAT_SNDBUF", 262144))  # Kernel send buffer per client socket
+RCVBUF_SIZE = int(os.environ.get("CHAT_RCVBUF", 262144))  # Kernel receive buffer per client socket
+BACKLOG = int(os.environ.get("CHAT_BACKLOG", socket.SOMAXCONN))  # Pending connections queued before accept
+FASTOPEN_QUEUE = 5  # Pending TCP Fast Open requests the kernel keeps
+MAX_SESSIONS = int(os.environ.get("CHAT_MAX_SESSIONS", 512))  # Chat sessions allowed to run at once
+WORKERS = int(os.environ.get("CHAT_WORKERS", 1))  # Server processes sharing the port (POSIX only)
+
+# Global state, only ever touched from the event loop's thread so no locking is needed
+pending_clients = None  # asyncio.Queue feeding the matcher, created on the running loop in `main`
+session_slots = None    # asyncio.Semaphore holding one slot per running session, created in `main`
+matcher_task = None     # The `match_clients` task, kept referenced for the server's lifetime
+session_tasks = set()   # Running `handle_messages` tasks; the loop itself only keeps weak references
+waiting_set = set()     # Clients still waiting to be paired, for O(1) membership tests and removal
 active_pairs = {}     # Mapping from client to their partner
-usernames = {}        # Mapping from socket to username
-chat_history = []     # List of all chat logs
-lock = Lock() # Lock for thread-safe operations
-# Initialize the server socket
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind((SERVER, PORT))
-server.listen(5)
-print(f"Server started on {SERVER}:{PORT}. Waiting for clients to connect...")
-# Function to handle incoming client connections
-def handle_client(client):
+usernames = {}        # Mapping from client to username
+session_messages_by_client = {}  # Mapping from paired client to its session's message list (shared by both partners)
+history_by_user = {}  # Mapping from username to the chat logs they took part in
+readers = {}          # Mapping from client (its StreamWriter) to its StreamReader
+rx_buffers = {}       # Mapping from client to the bytes read but not yet parsed into frames
+pending_events = {}   # Mapping from waiting client to the Event set once it is paired
+eof_watchers = {}     # Mapping from waiting client to the task watching its stream for EOF
+history_cache = {}    # Mapping from username to (number of logs, formatted [HISTORY] reply)
+log_queue = Queue()   # Chat logs waiting to be appended to LOG_FILE_PATH by the writer thread
+
+def configure_client_socket(client):
+    """
+    Tunes a newly accepted client's socket and write buffer.
+
+    Nagle's algorithm is disabled so chat lines are sent immediately, keepalive
+    probes let the kernel notice peers that vanished without a FIN, and the
+    kernel buffers are enlarged (CHAT_SNDBUF / CHAT_RCVBUF) so bursts are
+    absorbed without stalling the relay. The transport's write buffer
+    coalesces frames queued while the socket is busy and flushes them
+    together; `send_frame` only waits once more than WRITE_BUFFER_HIGH bytes
+    are pending.
+    """
+    sock = client.get_extra_info('socket')
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+    client.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+
+def rearm_quickack(client):
+    """Re-enables TCP_QUICKACK (Linux only), which the kernel clears after every ACK."""
+    if hasattr(socket, 'TCP_QUICKACK'):
+        client.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+def add_waiting(client):
+    """Hands the client to the matcher through the pending queue."""
+    waiting_set.add(client)
+    pending_clients.put_nowait(client)
+
+def remove_waiting(client):
+    """Removes the client from the waiting list; its queue entry is skipped later by `match_clients`."""
+    waiting_set.discard(client)
+
+async def match_clients():
+    """
+    Pairs waiting clients two at a time, in arrival order.
+
+    This is the only coroutine that pairs clients: `handle_client` just
+    enqueues the client and sleeps on its pending event. Clients that left
+    while queued are no longer in `waiting_set` and are skipped.
+
+    No more than MAX_SESSIONS chats run at once: a pair is only started once
+    it holds a slot of `session_slots`, released when its session ends.
+    Clients keep waiting in arrival order meanwhile, so none is starved.
+    """
+    partner = None
+    while True:
+        client = await pending_clients.get()
+        if client not in waiting_set:
+            continue  # Disconnected while queued
+        if partner is None or partner not in waiting_set:
+            partner = client
+            continue
+        await session_slots.acquire()
+        if client in waiting_set and partner in waiting_set:
+            try:
+                await pair_clients(client, partner)
+            except Exception as e:
+                # No session was started for them; keep pairing everyone else
+                print(f"Unexpected error pairing clients: {e!r}")
+                session_slots.release()
+                await cleanup_client(client)
+                await cleanup_client(partner)
+            partner = None
+        else:
+            # One of them left while we waited for a slot
+            session_slots.release()
+            if partner not in waiting_set:
+                partner = client if client in waiting_set else None
+
+async def send_frame(client, data):
+    """
+    Queues `data` for the client as a single length-prefixed frame.
+
+    The header and payload are handed to the transport without being
+    concatenated; `drain` returns at once unless the client's write buffer
+    is above WRITE_BUFFER_HIGH.
+    """
+    client.writelines((len(data).to_bytes(HEADER_SIZE, 'big'), data))
+    await client.drain()
+
+async def safe_send(client, data):
+    """
+    Sends a frame to a client that may already be gone.
+
+    Used for notifications whose loss must not abort the caller. Writers that
+    are already closing are skipped, and connection errors are swallowed.
+
+    Returns:
+        bool: True if the frame was queued, False if the client is unreachable.
+    """
+    if client.is_closing():
+        return False
+    try:
+        await send_frame(client, data)
+        return True
+    except OSError:
+        return False
+
+async def recv_frame(client, max_size=MAX_FRAME_SIZE):
+    """
+    Reads one length-prefixed frame from the client and returns its payload.
+
+    Reads of up to READ_SIZE bytes are appended to the client's receive
+    buffer, and frames are cut from its front; when one read brings in
+    several frames, the following calls return them without reading again.
+    A client that closes its connection between frames makes the read
+    return b'' (its FIN); this is reported as None rather than raised.
+    TCP_QUICKACK is re-armed after every read that returned data.
+
+    Args:
+        client (asyncio.StreamWriter): The client's stream.
+        max_size (int, optional): Largest payload accepted, MAX_FRAME_SIZE by default;
+            a bigger frame is rejected as soon as its header arrives, before its
+            body is buffered.
+
+    Returns:
+        bytes | None: The payload, or None once the client has disconnected.
+
+    Raises:
+        asyncio.IncompleteReadError: If the client disconnects in the middle of a frame.
+        ValueError: If the frame is larger than `max_size`.
+    """
+    reader = readers[client]
+    buf = rx_buffers[client]
+    while True:
+        if len(buf) >= HEADER_SIZE:
+            end = HEADER_SIZE + int.from_bytes(buf[:HEADER_SIZE], 'big')
+            if end - HEADER_SIZE > max_size:
+                raise ValueError(f"frame of {end - HEADER_SIZE} bytes exceeds {max_size}")
+            if len(buf) >= end:
+                with memoryview(buf) as view:
+                    frame = bytes(view[HEADER_SIZE:end])
+                del buf[:end]
+                return frame
+        data = await reader.read(READ_SIZE)
+        if not data:
+            if buf:
+                raise asyncio.IncompleteReadError(bytes(buf), None)
+            return None
+        rearm_quickack(client)
+        buf += data
+
+# Coroutine to handle incoming client connections
+async def handle_client(reader, client):
     """
     Handle incoming client connections and manage their chat sessions.
     
-    This function runs in a separate thread for each client. It handles the
-    client's connection, pairing them with another client, and managing their
-    chat session.
+    This coroutine runs as its own task on the event loop for each client.
+    It handles the client's connection, pairing them with another client,
+    and managing their chat session.
     
     Args:
-        client (socket.socket): The client socket object.
+        reader (asyncio.StreamReader): The stream the client's messages are read from.
+        client (asyncio.StreamWriter): The client's stream, used as its handle everywhere.
     
     Returns:
         None
     """
-    username = receive_username(client)
+    print(f"Connection established with {client.get_extra_info('peername')}.")
+    readers[client] = reader
+    rx_buffers[client] = bytearray()
+    configure_client_socket(client)
+    username = await receive_username(client)
     if not username:
+        readers.pop(client, None)
+        rx_buffers.pop(client, None)
         return
 
     # Notify the client of successful connection
-    client.send("[CONNECTED]".encode('utf-8'))
+    await send_frame(client, MSG_CONNECTED)
     print(f"{username} connected.")
-    if client not in waiting_clients:
+    if client not in waiting_set:
         # Add the client to the waiting list
-        with lock:
-            waiting_clients.append(client)
-            print(f"{username} added to waiting list.")
-    # Ensure the client is in the waiting list then wait for a partner
-    while client not in waiting_clients:
-        time.sleep(1)
-        print(f"{username} is not in the waiting list.")
-        
-    wait_for_partner(client)
+        pending_events[client] = asyncio.Event()
+        add_waiting(client)
+        print(f"{username} added to waiting list.")
+
+    await wait_for_partner(client)
 
-def receive_username(client):
+async def receive_username(client):
     """Receives and validates the username from the client."""
     try:
-        message = client.recv(1024).decode('utf-8')
-        if message.startswith("[USERNAME]"):
-            username = message.split("[USERNAME]")[1]
+        frame = await recv_frame(client, MAX_USERNAME_FRAME)
+        if frame is None:
+            print("Client disconnected before sending a username.")
+            client.close()
+            return None
+        username = None
+        if frame.startswith(USERNAME_PREFIX):
+            username = frame[len(USERNAME_PREFIX):].decode('utf-8')
+        if username:
             usernames[client] = username
             print(f"Username received: {username}")
             return username
         else:
-            print(f"Invalid username format from {client}.")
-            client.send("[INVALID_USERNAME]".encode('utf-8'))
+            # Wrong prefix or empty name
+            print(f"Invalid username from {client}.")
+            await safe_send(client, MSG_INVALID_USERNAME)
             client.close()
             return None
-    except Exception as e:
+    except (*CONNECTION_ERRORS, ValueError) as e:
+        # ValueError also covers UnicodeDecodeError
         print(f"Error receiving username: {e}")
         client.close()
         return None
 
-def wait_for_partner(client):
+async def wait_for_partner(client):
     """
-    Waits for a partner to be available for the client.
+    Waits for the matcher to pair the client with a partner.
 
-    This function checks if there are any clients in the waiting list.
-    If a partner is found, it pairs them and starts a chat session.
-    If no partner is found, it keeps the client in the waiting list.
+    If nobody else is waiting, the client is told that no partner was found
+    yet. Either way it sleeps on its pending event until `pair_clients`
+    sets it; the chat session itself runs in the task `pair_clients` starts.
+    Meanwhile `watch_for_eof` reads the client's stream, so a client that
+    disconnects while waiting is cleaned up instead of being paired.
 
     Args:
-        client (socket.socket): The client socket object.
+        client (asyncio.StreamWriter): The client's stream.
 
     Returns:
         None
     """
-    while True:
-        if client not in waiting_clients:
-            handle_client_not_in_waiting_list(client)
-            break
-
-        if client not in active_pairs:
-            if len(waiting_clients) > 1:
-                partner = waiting_clients.pop(0)
-                if partner and partner != client:
-                    pair_clients(client, partner)
-                    break
-            else:
-                handle_no_partner_found(client)
-        else:
-            handle_existing_partner(client)
-            break
+    # Fetched before any await: `pair_clients` pops the event once the client is
+    # paired, and `cleanup_client` pops the name if the client goes away meanwhile
+    event = pending_events.get(client)
+    username = usernames.get(client, 'Unknown')
+    if len(waiting_set) < 2:
+        await handle_no_partner_found(client)
+    if event is not None and not event.is_set():
+        watcher = asyncio.ensure_future(watch_for_eof(client))
+        eof_watchers[client] = watcher
+        woken = asyncio.ensure_future(event.wait())
+        await asyncio.wait((watcher, woken), return_when=asyncio.FIRST_COMPLETED)
+        woken.cancel()
+        watcher.cancel()
+        eof_watchers.pop(client, None)
+    handle_client_not_in_waiting_list(client, username)
+    if client not in active_pairs:
+        await cleanup_client(client)
+
+async def watch_for_eof(client):
+    """
+    Reads a waiting client's stream until it is closed.
 
-def handle_client_not_in_waiting_list(client):
+    Anything the client sends before being paired is kept in its receive
+    buffer for `recv_frame`, up to one maximum-size frame; a client that
+    sends more is treated as gone. Returns when the client disconnects;
+    cancelled by `handle_messages` once the client is paired.
+    """
+    reader = readers[client]
+    buf = rx_buffers[client]
+    try:
+        data = await reader.read(READ_SIZE)
+        while data:
+            buf += data
+            if len(buf) > HEADER_SIZE + MAX_FRAME_SIZE:
+                print(f"{usernames.get(client, 'Unknown')} sent too much while waiting.")
+                return
+            data = await reader.read(READ_SIZE)
+    except CONNECTION_ERRORS:
+        pass
+
+def handle_client_not_in_waiting_list(client, username):
     """Handles the case where the client is not in the waiting list."""
-    username = usernames.get(client, 'Unknown')
     print(f"{username} is no longer in the waiting list.")
     if client in active_pairs:
-        pair_clients(client, active_pairs[client])
         print(f"{username} already has a partner.")
     else:
-        raise ValueError(f"ClientError: {username} not in waiting list.")
+        print(f"{username} left while waiting for a partner.")
 
-def handle_no_partner_found(client):
+async def handle_no_partner_found(client):
     """Handles the case where no partner is found in the waiting list."""
     username = usernames.get(client, 'Unknown')
     print(f"{username} is waiting for a partner...")
-    client.send("[NO_PARTNER_FOUND]".encode('utf-8'))
-    time.sleep(1)
-
-def handle_existing_partner(client):
-    """Handles the case where the client already has a partner."""
-    pair_clients(client, active_pairs[client])
-    print(f"{usernames.get(client, 'Unknown')} already has a partner.")
+    await safe_send(client, MSG_NO_PARTNER_FOUND)
 
-    
-def cleanup_client(client):
+async def cleanup_client(client):
     """
     Cleans up client resources, removes them from active lists, and notifies their partner.
 
     This function ensures that when a client disconnects (either intentionally or due to an error),
-    they are properly removed from the `waiting_clients` list and `active_pairs` dictionary.
+    they are properly removed from the waiting queue and the `active_pairs` dictionary.
     If the client was actively paired with someone, their partner is notified of the disconnection.
+    A partner that cannot be notified is cleaned up as well; this is done from a work list
+    rather than by recursion, so a mass disconnect never grows the call stack. All of a
+    client's entries are removed before its partner is notified, the only await here.
 
     Args:
-        client (socket.socket): The socket object of the client to be cleaned up.
+        client (asyncio.StreamWriter): The stream of the client to be cleaned up.
     """
-    try:
+    pending_cleanup = [client]
+    cleaned = set()
+    while pending_cleanup:
+        client = pending_cleanup.pop()
+        if client in cleaned or client not in readers:
+            continue  # Already cleaned up, here or by an earlier call
+        cleaned.add(client)
         username = usernames.get(client, "Unknown")
-        with lock: 
+        try:
             # Remove client from waiting clients if present
-            if client in waiting_clients:
-                waiting_clients.remove(client)
-
-        # Handle active pair disconnection
-        if client in active_pairs:
-            partner = active_pairs.pop(client)
-            try:
-                partner.send("[PARTNER_LEFT]".encode('utf-8'))
-                print(f"Notified {usernames.get(partner, 'Unknown')} of disconnection.")
-            except Exception as e:
-                print(f"Error notifying partner: {e}")
-                # Optionally, handle the partner's disconnection as well
-                cleanup_client(partner)  # Recursive call if needed
-        elif any(client == v for v in active_pairs.values()):
-            # Find the client that has client as a value
-            partner = next(k for k, v in active_pairs.items() if v == client)
-            del active_pairs[partner]
+            remove_waiting(client)
+            # Wake a client still waiting for a partner so its handler can return
+            event = pending_events.pop(client, None)
+            if event:
+                event.set()
+            # Drop the client's entries before the await below, so no other task sees half of them
+            readers.pop(client, None)
+            rx_buffers.pop(client, None)
+            # The session's chat log has been saved by now, the name is no longer needed
+            usernames.pop(client, None)
+            history_cache.pop(username, None)
+
+            # Handle active pair disconnection; pairs are stored in both directions
+            partner = active_pairs.pop(client, None)
+            if partner is not None:
+                active_pairs.pop(partner, None)
+                partner_name = usernames.get(partner, 'Unknown')
+                if await safe_send(partner, MSG_PARTNER_LEFT):
+                    print(f"Notified {partner_name} of disconnection.")
+                else:
+                    print(f"Error notifying partner: {partner_name} is unreachable.")
+                    # Handle the partner's disconnection as well
+                    pending_cleanup.append(partner)
+
+        except Exception as e:
+            print(f"Error during cleanup: {e}")
+        finally:
             try:
-                partner.send("[PARTNER_LEFT]".encode('utf-8'))
-                print(f"Notified {usernames.get(partner, 'Unknown')} of disconnection.")
-            except Exception as e:
-                print(f"Error notifying partner: {e}")
-                # Optionally, handle the partner's disconnection as well
-                cleanup_client(partner)  # Recursive call if needed
-
-    except Exception as e:
-        print(f"Error during cleanup: {e}")
-    finally:
-        try:
-            client.close()
-            print(f"Connection with {username} closed.")
-        except Exception:
-            print("Client already closed")
+                client.close()
+                print(f"Connection with {username} closed.")
+            except Exception:
+                print("Client already closed")
 
-def pair_clients(client1, client2):
+async def pair_clients(client1, client2):
     """
-    Pairs two clients for a chat session and starts a dedicated message handling thread.
+    Pairs two clients for a chat session and starts a dedicated message handling task.
 
-    This function establishes a chat session between two clients by:
+    This coroutine establishes a chat session between two clients by:
     1. Sending a "[CHAT_FOUND]" notification to both clients.
-    2. Adding both clients to the `active_pairs` dictionary, mapping each client to their partner.
-    3. Starting a new thread that executes the `handle_messages` function, responsible for
-       relaying messages between the paired clients.
+    2. Adding both clients to the `active_pairs` dictionary, mapping each client to their partner,
+       and giving the pair a fresh message list in `session_messages_by_client`.
+    3. Waking up any client still sleeping on its pending event.
+    4. Starting a single task that runs the `handle_messages` coroutine, responsible for
+       relaying messages in both directions between the paired clients.
+    If one of them cannot be reached, the other goes back to the waiting queue
+    (told "[PARTNER_LEFT]" if it had already received "[CHAT_FOUND]").
 
     Args:
-        client1 (socket.socket): The socket object of the first client.
-        client2 (socket.socket): The socket object of the second client.
+        client1 (asyncio.StreamWriter): The stream of the first client.
+        client2 (asyncio.StreamWriter): The stream of the second client.
     """
+    notified = []  # Clients that were already told about this pairing
     try:
-        # Notify clients that a chat partner has been found (the other client will be notified thanks to the partner)
-        client1.send("[CHAT_FOUND]".encode('utf-8'))
+        # Notify both clients that a chat partner has been found
+        for client in (client1, client2):
+            await send_frame(client, MSG_CHAT_FOUND)
+            notified.append(client)
         
         # Update active pairs
         active_pairs[client1] = client2
         active_pairs[client2] = client1
+        # Both partners append to the same message list for this session
+        session_messages_by_client[client1] = session_messages_by_client[client2] = []
         
         # Remove clients from waiting list
-        if client1 in waiting_clients:
-            waiting_clients.remove(client1)
-        if client2 in waiting_clients:
-            waiting_clients.remove(client2)
-        
-
-        print(f"Paired clients: {usernames.get(client1, 'Unknown')} and {usernames.get(client2, 'Unknown')}")
-
-        # Start a new thread to handle messages between the clients
-        threading.Thread(target=handle_messages, args=(client1, client2)).start()
-        print(f"Started message handling message for {usernames.get(client1, 'Unknown')} and {usernames.get(client2, 'Unknown')}")
-    except Exception as e:
+        remove_waiting(client1)
+        remove_waiting(client2)
+        # Wake up the clients waiting for a partner
+        for client in (client1, client2):
+            event = pending_events.pop(client, None)
+            if event:
+                event.set()
+
+        u1 = usernames.get(client1, 'Unknown')
+        u2 = usernames.get(client2, 'Unknown')
+        print(f"Paired clients: {u1} and {u2}")
+
+        # Start a new task to handle messages between the clients (kept last, so
+        # an error raised above never leaves a session running)
+        print(f"Started message handling message for {u1} and {u2}")
+        session = asyncio.ensure_future(handle_messages(client1, client2))
+        session_tasks.add(session)
+        session.add_done_callback(session_tasks.discard)
+    except CONNECTION_ERRORS as e:
         print(f"Error pairing clients: {e}")
-        cleanup_client(client1)
-        cleanup_client(client2)
-
-def handle_messages(client1, client2):
+        session_slots.release()
+        for client in (client1, client2):
+            if client.is_closing():
+                await cleanup_client(client)
+            else:
+                # Still reachable: back in the queue for the next partner
+                if client in notified:
+                    # Its UI already switched to chatting, take it back to waiting
+                    await safe_send(client, MSG_PARTNER_LEFT)
+                add_waiting(client)
+
+async def relay_messages(client, other_client):
+    """Relays messages from `client` to `other_client` until `client` disconnects."""
+    uname = usernames.get(client)  # Looked up once per session, not per message
+    while await handle_client_message(client, other_client, uname):
+        pass
+
+async def handle_messages(client1, client2):
     """
     Handles real-time message exchange between two paired clients.
 
-    This function continuously listens for incoming messages from both clients.
-    When a message is received from one client, it is relayed to the other client.
-    If a client disconnects, the other client is notified, and the function terminates.
+    Each direction is relayed by its own `relay_messages` task, so both
+    clients are listened to at the same time and neither waits for the
+    other to speak. When one client disconnects, the other client is
+    notified, the remaining relay is cancelled, and the session ends.
 
     Args:
-        client1 (socket.socket): The socket object of the first client.
-        client2 (socket.socket): The socket object of the second client.
+        client1 (asyncio.StreamWriter): The stream of the first client.
+        client2 (asyncio.StreamWriter): The stream of the second client.
     """
+    # Stop the waiting-phase EOF watchers first: a stream has only one reader at a time
+    watchers = [eof_watchers.pop(c) for c in (client1, client2) if c in eof_watchers]
+    for watcher in watchers:
+        watcher.cancel()
+    await asyncio.gather(*watchers, return_exceptions=True)
+    relays = [
+        asyncio.ensure_future(relay_messages(client1, client2)),
+        asyncio.ensure_future(relay_messages(client2, client1)),
+    ]
     try:
-        while True:
-            # Handle message from client1
-            message_exchange_c1_c2 = handle_client_message(client1, client2)
-            if not message_exchange_c1_c2 :
-                break
-        while True:
-            # Handle message from client2
-            message_exchange_c2_c1 = handle_client_message(client2, client1)
-            if not message_exchange_c2_c1:
-                break
+        done, _ = await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+        for relay in done:
+            # Re-raise an error from the relay that ended the session
+            relay.result()
     except Exception as e:
         print(f"Error handling messages: {e}")
     finally:
+        for relay in relays:
+            relay.cancel()
+        session_slots.release()
         # Save chat log when the session ends
         pair_user1 = usernames.get(client1, "Unknown")
         pair_user2 = usernames.get(client2, "Unknown")
-        messages = chat_history
+        messages = session_messages_by_client.pop(client1, [])
+        session_messages_by_client.pop(client2, None)
         # Save chat log to JSON file
         save_chat_log(pair_user1, pair_user2, messages)
         # Notify history has been saved
         print(f"Chat log saved for {pair_user1} and {pair_user2}.")
         # Cleanup clients after the chat session ends
-        cleanup_client(client1)
-        cleanup_client(client2)
+        await cleanup_client(client1)
+        await cleanup_client(client2)
         print("Chat session ended.")
 
-def handle_client_message(client, other_client):
+async def handle_client_message(client, other_client, uname):
     """
     Handles receiving and processing messages from a single client.
 
+    Frames are dispatched by comparing their bytes with the MSG_* constants;
+    only chat messages are decoded, for the session's history.
+
     Args:
-        client (socket.socket): The socket object of the client.
-        other_client (socket.socket): The socket object of the other client in the pair.
+        client (asyncio.StreamWriter): The stream of the client.
+        other_client (asyncio.StreamWriter): The stream of the other client in the pair.
+        uname (str): The client's username.
 
     Returns:
         bool: True if the message was handled successfully, False if the client disconnected.
     """
     try:
-        message = client.recv(1024).decode('utf-8')
-    except Exception:
-        message = "[DISCONNECTED]"
-
-    if message == "[DISCONNECTED]":
-        print(f"Client {usernames.get(client)} disconnected.")
-        other_client.send("[PARTNER_DISCONNECTED]".encode('utf-8'))
+        frame = await recv_frame(client)
+    except CONNECTION_ERRORS:
+        frame = None  # Connection reset, or closed in the middle of a frame
+    except ValueError as e:
+        # Oversized frame: end the session, which closes the client
+        print(f"Rejected frame from {uname}: {e}")
+        frame = None
+
+    if frame is None or frame == MSG_DISCONNECTED:
+        print(f"Client {uname} disconnected.")
+        await safe_send(other_client, MSG_PARTNER_DISCONNECTED)
         return False
-    elif message == "[HELP]":
-        client.send("[HELP]".encode('utf-8'))
-    elif message == "[HISTORY]":
-        log_file_path = "history/chat_logs.json"
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
-        # Check if the file exists and read existing logs
-        if os.path.exists(log_file_path):
-            try:
-                with open(log_file_path, "r") as f:
-                    try:
-                        logs = json.load(f)
-                    except json.JSONDecodeError:
-                        client.send("Error decoding chat history.".encode('utf-8'))
-                        return True
-                    # Filter logs for the current user
-                    user_logs = []
-                    for log in logs:
-                        if log["user1"] == usernames.get(client) or log["user2"] == usernames.get(client):
-                            user_logs.append(log)
-                    if user_logs:
-                        formatted_history = ""
-                        for log in user_logs:
-                            formatted_history += f"Chat with {log['user1'] if log['user1'] != usernames.get(client) else log['user2']} at {log['timestamp']}:\n"
-                            for msg in log["messages"]:
-                                formatted_history += f"  {msg['user']}: {msg['message']}\n"
-                            formatted_history += "\n"
-                        client.send(formatted_history.encode('utf-8'))
-                    else:
-                        client.send("No chat history available for this user.".encode('utf-8'))
-            except FileNotFoundError:
-                client.send("No chat history available.".encode('utf-8'))
-        else:
-            client.send("No chat history available.".encode('utf-8'))
+    elif frame == MSG_HELP:
+        await send_frame(client, MSG_HELP)
+    elif frame == MSG_HISTORY:
+        await send_frame(client, format_history(uname))
     else:
-        # Relay the message to the other client
-        other_client.send(message.encode('utf-8'))
-        # Save chat history
-        chat_history.append({"user": usernames.get(client), "message": message})
-        # Print the message to the server console
-        print(f"{message}")
+        # Relay the message to the other client as received
+        await send_frame(other_client, frame)
+        # Save chat history; the message is not echoed to the console, which would
+        # block the relay on stdout
+        message = frame.decode('utf-8', 'replace')
+        session_messages_by_client[client].append({"user": uname, "message": message})
     return True
 
+def format_history(uname):
+    """
+    Returns the `[HISTORY]` reply for a user, encoded and ready to send.
+
+    Served from the in-memory index, the log file is never re-read. The
+    reply is cached per user together with the number of logs it covers,
+    so it is only rebuilt after the user finishes another chat.
+
+    Args:
+        uname (str): The username whose history is requested.
+
+    Returns:
+        bytes: The formatted history, or MSG_NO_HISTORY if there is none.
+    """
+    user_logs = history_by_user.get(uname)
+    if not user_logs:
+        return MSG_NO_HISTORY
+    cached = history_cache.get(uname)
+    if cached and cached[0] == len(user_logs):
+        return cached[1]
+    parts = []
+    for log in user_logs:
+        parts.append(f"Chat with {log['user1'] if log['user1'] != uname else log['user2']} at {log['timestamp']}:\n")
+        parts.extend(f"  {msg['user']}: {msg['message']}\n" for msg in log["messages"])
+        parts.append("\n")
+    formatted_history = "".join(parts).encode('utf-8')
+    history_cache[uname] = (len(user_logs), formatted_history)
+    return formatted_history
+
+def index_chat_log(chat_log):
+    """Adds a chat log to `history_by_user` under both participants."""
+    for user in {chat_log["user1"], chat_log["user2"]}:
+        history_by_user.setdefault(user, []).append(chat_log)
+
+def load_history():
+    """
+    Builds the `history_by_user` index by streaming the chat log files once.
+
+    Called at startup; afterwards `save_chat_log` keeps the index up to
+    date, so `[HISTORY]` requests never touch the disk. The rotated files are
+    read oldest first, then the current one, so logs stay in chronological order. Lines
+    that cannot be decoded are skipped with a warning.
+    """
+    paths = [rotated_log_path(n) for n in range(LOG_BACKUP_COUNT, 0, -1)] + [LOG_FILE_PATH]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    index_chat_log(json.loads(line))
+                except json.JSONDecodeError:
+                    print("Warning: Failed to decode a chat log line, skipping it.")
+
 def save_chat_log(pair_user1, pair_user2, messages):
     """
-    Saves the chat log of a conversation between two users to a JSON file.
+    Saves the chat log of a conversation between two users to a JSON Lines file.
 
     The chat log includes the usernames of both participants, a timestamp of when the
-    conversation occurred, and a list of messages exchanged.  Each chat log is
-    appended as a new line in the "chat_logs.json" file.
+    conversation occurred, and a list of messages exchanged. The log is added to the
+    in-memory `history_by_user` index right away and queued for `write_chat_logs`,
+    which appends it to LOG_FILE_PATH from its own thread, so the event loop never
+    waits on the disk.
 
     Args:
         pair_user1 (str): The username of the first user in the chat.
@@ -351,53 +653,216 @@ def save_chat_log(pair_user1, pair_user2, messages):
         "timestamp": datetime.datetime.now().isoformat(),
         "messages": messages
     }
-    
-    log_file_path = "history/chat_logs.json"
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+    index_chat_log(chat_log)
+    log_queue.put(chat_log)
 
-    logs = []
+def dump_chat_log(chat_log):
+    """Serialises a chat log to one JSON Lines record, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(chat_log) + b"\n"
+    return json.dumps(chat_log).encode('utf-8') + b"\n"
 
-    # Check if the file exists and read existing logs
-    if os.path.exists(log_file_path):
-        try:
-            with open(log_file_path, "r") as f:
-                logs = json.load(f)
-        except json.JSONDecodeError:
-            print("Warning: Failed to decode JSON, starting with an empty log.")
-    # Append the new chat log
-    logs.append(chat_log)
-    # Write the updated logs back to the file
+def open_log_file():
+    """
+    Opens LOG_FILE_PATH for appending, creating it and its directory if needed.
+
+    Returns:
+        int: A raw O_APPEND file descriptor; every `os.write` on it lands at the
+             end of the file, even with several worker processes appending.
+    """
+    os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
+    return os.open(LOG_FILE_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+def write_all(fd, data):
+    """Writes `data` to `fd`, normally in one `os.write` call; retries only after a short write."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def rotated_log_path(n):
+    """Returns the path of the n-th rotated log file, 1 being the most recent."""
+    return f"{LOG_FILE_PATH}.{n}"
+
+def rotate_log_files():
+    """
+    Moves LOG_FILE_PATH to `.1`, shifting the older rotated files up by one.
+
+    Only LOG_BACKUP_COUNT rotated files are kept: the oldest one is
+    overwritten, and the chats it held are deleted for good (they no longer
+    show up in `[HISTORY]` after a restart).
+    """
+    for n in range(LOG_BACKUP_COUNT - 1, 0, -1):
+        if os.path.exists(rotated_log_path(n)):
+            os.replace(rotated_log_path(n), rotated_log_path(n + 1))
+    os.replace(LOG_FILE_PATH, rotated_log_path(1))
+
+def is_current_log_file(fd):
+    """Tells whether `fd` is still the file at LOG_FILE_PATH, i.e. no worker has rotated it away."""
     try:
-        with open(log_file_path, "w") as f:
-            json.dump(logs, f, indent=4)
-            f.write("\n")  # Add a newline to separate JSON objects
-        print(f"Chat log saved for {pair_user1} and {pair_user2}.")
-    except Exception as e:
-        print(f"Error saving chat log: {e}")
+        current = os.stat(LOG_FILE_PATH)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(fd)
+    return (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino)
+
+def rotate_if_full(fd):
+    """
+    Rotates the log files once the file behind `fd` has reached LOG_MAX_SIZE.
+
+    The check, the rotation and the reopen happen under an exclusive lock on
+    LOG_LOCK_PATH, so two workers crossing the limit together rotate only once:
+    the second one re-checks under the lock, sees its file was already rotated
+    away, and just reopens LOG_FILE_PATH.
+
+    Returns:
+        int: The descriptor to keep writing to (`fd` itself, or a new one).
+    """
+    if os.fstat(fd).st_size < LOG_MAX_SIZE:
+        return fd
+    with open(LOG_LOCK_PATH, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # Released when the lock file is closed
+        if is_current_log_file(fd):
+            rotate_log_files()
+        os.close(fd)
+        return open_log_file()
+
+def write_chat_logs():
+    """
+    Appends queued chat logs to LOG_FILE_PATH until a None sentinel is queued.
+
+    Runs in the background writer thread, which keeps the log file open for
+    its whole life. Every log already queued when the thread wakes up is
+    serialised up front and written with a single unbuffered `os.write`.
+    Once the file grows past LOG_MAX_SIZE it is rotated by `rotate_if_full`
+    and a new one is started. With several workers, the others notice the
+    file was replaced and reopen LOG_FILE_PATH before their next write.
+    """
+    fd = open_log_file()
+    running = True
+    while running:
+        logs = [log_queue.get()]
+        while not log_queue.empty():
+            logs.append(log_queue.get_nowait())
+        if None in logs:
+            # Shutdown requested: write what came before the sentinel and stop
+            running = False
+            logs = [log for log in logs if log is not None]
+            if not logs:
+                break
+        try:
+            if not is_current_log_file(fd):
+                # Another worker rotated the file: follow it to the new one
+                os.close(fd)
+                fd = open_log_file()
+            write_all(fd, b"".join(dump_chat_log(log) for log in logs))
+            fd = rotate_if_full(fd)
+        except Exception as e:
+            print(f"Error saving chat log: {e}")
+    os.close(fd)
+
+def create_listening_socket():
+    """
+    Creates the server's listening socket, bound to SERVER:PORT.
+
+    SO_REUSEADDR lets the server restart while old connections linger in
+    TIME_WAIT, and TCP_FASTOPEN (where the platform has it) lets returning
+    clients send data in their SYN. With several workers, each one binds its
+    own socket with SO_REUSEPORT and the kernel spreads connections across them.
+
+    Returns:
+        socket.socket: The bound, listening socket.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if WORKERS > 1:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if hasattr(socket, 'TCP_FASTOPEN'):
+        try:
+            server.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, FASTOPEN_QUEUE)
+        except OSError:
+            pass  # Disabled by the kernel
+    server.bind((SERVER, PORT))
+    server.listen(BACKLOG)
+    return server
+
+async def main():
+    """
+    Opens the listening socket and serves clients until cancelled.
+
+    `asyncio.start_server` accepts every connection on the event loop and
+    runs `handle_client` as a new task for it, so all clients share one thread.
+    A single `match_clients` task pairs the clients they enqueue.
+    """
+    global pending_clients, session_slots, matcher_task
+    load_history()
+    pending_clients = asyncio.Queue()
+    session_slots = asyncio.Semaphore(MAX_SESSIONS)
+    matcher_task = asyncio.ensure_future(match_clients())
+    server = await asyncio.start_server(handle_client, sock=create_listening_socket(), backlog=BACKLOG)
+    print(f"Server started on {SERVER}:{PORT}. Waiting for clients to connect...")
+    async with server:
+        await server.serve_forever()
+
+def fork_workers():
+    """
+    Forks WORKERS - 1 additional server processes.
+
+    Each process runs its own event loop and listening socket, so clients are
+    only paired with clients accepted by the same worker. Platforms without
+    `os.fork` or SO_REUSEPORT always run a single process.
+    """
+    global WORKERS
+    if WORKERS > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+        print("Multiple workers are not supported on this platform, running one.")
+        WORKERS = 1
+    for _ in range(WORKERS - 1):
+        if os.fork() == 0:
+            break  # Children do not fork further
+
+def run_event_loop(coro):
+    """
+    Runs `coro` to completion on a new event loop, uvloop's when it is installed.
+
+    uvloop's loop is created directly rather than through `uvloop.install()`,
+    whose global event loop policy is deprecated on recent Python versions;
+    only uvloop releases that predate `uvloop.run` fall back to it.
+    """
+    if uvloop is None:
+        asyncio.run(coro)
+    elif hasattr(uvloop, 'run'):
+        uvloop.run(coro)
+    else:
+        uvloop.install()
+        asyncio.run(coro)
 
 def start_server():
     """
-    Starts the server, listens for incoming connections, and spawns threads to handle clients.
+    Starts the server and runs its event loop until interrupted.
 
     This function performs the following steps:
-    1. Creates a socket and binds it to the specified host and port.
-    2. Listens for incoming connection requests.
-    3. Enters a loop that continuously accepts new client connections.
-    4. For each new connection, it creates a new thread that executes the
-       `handle_client` function, passing the client's socket object as an argument.
+    1. Forks the extra worker processes requested by CHAT_WORKERS, if any;
+       every process then goes through the remaining steps.
+    2. Runs the `main` coroutine on a new event loop (uvloop's, when it is installed).
+    3. `main` binds the listening socket to the specified host and port.
+    4. The loop accepts new client connections and runs the `handle_client`
+       coroutine for each of them as a separate task.
+    Chat logs are written by a background thread, which is given the chance
+    to flush the remaining logs when the server stops.
     """
+    # Fork before any thread is started
+    fork_workers()
+    writer = threading.Thread(target=write_chat_logs, daemon=True)
+    writer.start()
     try:
-        while True:
-            client, address = server.accept()
-            print(f"Connection established with {address}.")
-            threading.Thread(target=handle_client, args=(client,)).start()
+        run_event_loop(main())
     except KeyboardInterrupt:
         print("\nServer shutting down...")
     except Exception as e:
         print(f"Error starting server: {e}")
     finally:
-        server.close()
+        log_queue.put(None)
+        writer.join()
         print("Server closed.")
 
 if __name__ == "__main__":